@@ -1,9 +1,12 @@
+import orjson
 from flask import Flask
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from flask_login import LoginManager
 from flask_jwt_extended import JWTManager
 import os
 from dotenv import load_dotenv
+from sqlalchemy.pool import NullPool
 from models import db, bcrypt, User
 from routes import api
 from auth import auth
@@ -11,9 +14,29 @@ from auth import auth
 load_dotenv()
 
 
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson.
+    Datetimes are encoded natively (stored values are naive UTC)."""
+
+    option = orjson.OPT_NAIVE_UTC
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=self.option), mimetype="application/json"
+        )
+
+
 def create_app(config=None):
     """Application factory pattern for creating Flask app instances"""
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
 
     # Enable CORS for frontend communication
     # Apply CORS to all routes with wildcard
@@ -35,12 +58,20 @@ def create_app(config=None):
 
         # Configure engine options based on database type
         if database_url and database_url.startswith("postgresql"):
-            # PostgreSQL-specific configuration
-            app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-                "pool_pre_ping": True,
-                "pool_recycle": 300,
-                "connect_args": {"sslmode": "require"},
-            }
+            if os.getenv("PGBOUNCER"):
+                # PgBouncer (transaction pooling) owns the connection pool;
+                # a second pool per worker would only pin server connections
+                app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+                    "poolclass": NullPool,
+                    "connect_args": {"sslmode": "require"},
+                }
+            else:
+                # PostgreSQL-specific configuration
+                app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+                    "pool_pre_ping": True,
+                    "pool_recycle": 300,
+                    "connect_args": {"sslmode": "require"},
+                }
         else:
             # SQLite configuration (or other databases)
             app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
@@ -55,6 +86,14 @@ def create_app(config=None):
         "JWT_SECRET_KEY", "jwt-secret-key-change-in-production"
     )
 
+    # bcrypt work factor; test apps default to bcrypt's minimum of 4 so
+    # registering and signing in stay cheap
+    if app.config.get("TESTING"):
+        app.config.setdefault("BCRYPT_LOG_ROUNDS", 4)
+    app.config.setdefault(
+        "BCRYPT_LOG_ROUNDS", int(os.getenv("BCRYPT_LOG_ROUNDS", "12"))
+    )
+
     # Initialize extensions with app
     db.init_app(app)
     bcrypt.init_app(app)
@@ -77,9 +116,11 @@ def create_app(config=None):
     def home():
         return "Hierarchical Todo List API"
 
-    # Create database tables
-    with app.app_context():
-        db.create_all()
+    # Schema creation normally belongs to init_db.py; allow opting in for
+    # throwaway local setups without adding startup work for every worker
+    if os.getenv("RUN_CREATE_ALL"):
+        with app.app_context():
+            db.create_all()
 
     return app
 
@@ -1,6 +1,7 @@
 from flask import Blueprint, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
+from sqlalchemy import insert
 from models import db, User
 
 # Create a blueprint for authentication routes
@@ -23,11 +24,20 @@ def register():
     if User.query.filter_by(email=data["email"]).first():
         return jsonify({"error": "Email already exists"}), 400
 
-    # Create new user
+    # Create new user: hash on a transient instance, then insert its columns
+    # with RETURNING so the generated values come back in the same round-trip
     new_user = User(username=data["username"], email=data["email"])
     new_user.set_password(data["password"])
 
-    db.session.add(new_user)
+    new_user.id, new_user.created_at, new_user.updated_at = db.session.execute(
+        insert(User)
+        .values(
+            username=new_user.username,
+            email=new_user.email,
+            password_hash=new_user.password_hash,
+        )
+        .returning(User.id, User.created_at, User.updated_at)
+    ).one()
     db.session.commit()
 
     # Create access token (identity must be a string)
@@ -61,6 +71,11 @@ def login():
     if not user or not user.check_password(data["password"]):
         return jsonify({"error": "Invalid username or password"}), 401
 
+    # Re-hash with the configured cost while we have the plaintext
+    if user.password_needs_rehash():
+        user.set_password(data["password"])
+        db.session.commit()
+
     # Login user (for session-based auth)
     login_user(user)
 
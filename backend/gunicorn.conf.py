@@ -0,0 +1,38 @@
+"""
+Gunicorn configuration for production
+Run with: gunicorn -c gunicorn.conf.py app:app
+"""
+
+# The app is preloaded in the master, so patch before it is imported: the
+# engine's pool locks must be gevent-aware, and psycopg2 must yield to other
+# greenlets while it waits on PostgreSQL
+from gevent import monkey
+
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg
+
+patch_psycopg()
+
+import multiprocessing
+import os
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+
+# Import the app once in the master and fork workers from it, so they share
+# the loaded modules copy-on-write instead of each importing them again
+preload_app = True
+
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gevent"
+worker_connections = 1000
+
+
+def post_fork(server, worker):
+    # The preloaded app may have connected in the master (RUN_CREATE_ALL).
+    # Drop the inherited pool without closing the master's sockets, so the
+    # worker opens its own connections.
+    from app import app, db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
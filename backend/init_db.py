@@ -9,10 +9,128 @@ import os
 # Add the backend directory to the path
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
+from sqlalchemy import inspect, text
 from app import app, db
 from models import User, List, Task
 
 
+def create_missing_indexes():
+    """Create indexes declared on the models that an existing database lacks.
+    create_all() skips them when the table itself already exists."""
+    concurrently = "CONCURRENTLY " if db.engine.dialect.name == "postgresql" else ""
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with db.engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                columns = ", ".join(column.name for column in index.columns)
+                connection.execute(
+                    text(
+                        f"CREATE INDEX {concurrently}IF NOT EXISTS "
+                        f"{index.name} ON {table.name} ({columns})"
+                    )
+                )
+
+
+def add_missing_sqlite_columns():
+    """Add the columns introduced after the first release to an existing
+    SQLite database. SQLite has no ADD COLUMN IF NOT EXISTS and only accepts
+    constant defaults, so check the schema first and fill lists_version in a
+    separate UPDATE."""
+    inspector = inspect(db.engine)
+    task_columns = {column["name"] for column in inspector.get_columns("tasks")}
+    user_columns = {column["name"] for column in inspector.get_columns("users")}
+
+    if "depth" not in task_columns:
+        db.session.execute(
+            text("ALTER TABLE tasks ADD COLUMN depth SMALLINT NOT NULL DEFAULT 0")
+        )
+    if "lists_version" not in user_columns:
+        db.session.execute(
+            text("ALTER TABLE users ADD COLUMN lists_version VARCHAR(32)")
+        )
+    db.session.execute(
+        text(
+            "UPDATE users SET lists_version = lower(hex(randomblob(16))) "
+            "WHERE lists_version IS NULL"
+        )
+    )
+    db.session.commit()
+
+
+def add_missing_columns():
+    """Add columns and defaults introduced after the first release to existing
+    databases (create_all() never alters tables that already exist)"""
+    if db.engine.dialect.name == "sqlite":
+        add_missing_sqlite_columns()
+        return
+    if db.engine.dialect.name != "postgresql":
+        return
+
+    db.session.execute(
+        text(
+            "ALTER TABLE tasks "
+            "ADD COLUMN IF NOT EXISTS depth SMALLINT NOT NULL DEFAULT 0"
+        )
+    )
+    db.session.execute(
+        text(
+            "ALTER TABLE users "
+            "ADD COLUMN IF NOT EXISTS lists_version VARCHAR(32) "
+            "DEFAULT md5(random()::text)"
+        )
+    )
+    # Timestamps used to be filled in by the application; they are naive UTC
+    for table in ("users", "lists", "tasks"):
+        for column in ("created_at", "updated_at"):
+            db.session.execute(
+                text(
+                    f"ALTER TABLE {table} ALTER COLUMN {column} "
+                    "SET DEFAULT TIMEZONE('utc', CURRENT_TIMESTAMP)"
+                )
+            )
+    db.session.commit()
+
+
+def backfill_task_depth():
+    """Fill in the stored tasks.depth column with a single recursive query
+    over the hierarchy"""
+    db.session.execute(
+        text(
+            """
+            WITH RECURSIVE t(id, d) AS (
+                SELECT id, 0 FROM tasks WHERE parent_id IS NULL
+                UNION ALL
+                SELECT c.id, t.d + 1 FROM tasks c JOIN t ON c.parent_id = t.id
+            )
+            UPDATE tasks SET depth = t.d FROM t WHERE tasks.id = t.id
+            """
+        )
+    )
+    db.session.commit()
+
+
+def repair_subtask_lists():
+    """Move subtasks left behind in another list back into the list of
+    their top-level task. Older releases moved a task to a new list
+    without its subtasks."""
+    db.session.execute(
+        text(
+            """
+            WITH RECURSIVE t(id, root_list_id) AS (
+                SELECT id, list_id FROM tasks WHERE parent_id IS NULL
+                UNION ALL
+                SELECT c.id, t.root_list_id FROM tasks c JOIN t ON c.parent_id = t.id
+            )
+            UPDATE tasks SET list_id = t.root_list_id
+            FROM t WHERE tasks.id = t.id AND tasks.list_id <> t.root_list_id
+            """
+        )
+    )
+    db.session.commit()
+
+
 def init_database():
     """Initialize the database with all tables"""
     with app.app_context():
@@ -24,6 +142,10 @@ def init_database():
 
             print("\n📋 Creating tables...")
             db.create_all()
+            add_missing_columns()
+            backfill_task_depth()
+            repair_subtask_lists()
+            create_missing_indexes()
 
             print("\n✅ SUCCESS! All tables created:")
             print("   ✓ users")
@@ -1,22 +1,94 @@
+import hashlib
+import hmac
+import sys
+import uuid
+from threading import Lock
+from cachetools import TTLCache
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from flask_bcrypt import Bcrypt
+from dataclasses import dataclass, field
 from datetime import datetime
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.sql.expression import FunctionElement
 
 db = SQLAlchemy()
 bcrypt = Bcrypt()
 
+# Passwords verified in the last minute, so repeated logins skip bcrypt.
+# Keys are keyed digests of (stored hash, password): changing the password
+# changes the stored hash, which invalidates any cached entry for it.
+verified_passwords = TTLCache(maxsize=10000, ttl=60)
+verified_passwords_lock = Lock()
+
+
+def run_blocking(func, *args):
+    """Run a CPU-bound call such as bcrypt hashing.
+    Under gevent workers it runs on the hub's native thread pool, so other
+    greenlets keep serving requests while bcrypt (which releases the GIL)
+    works; under sync workers it simply runs inline."""
+    gevent_monkey = sys.modules.get("gevent.monkey")
+    if gevent_monkey is not None and gevent_monkey.is_module_patched("threading"):
+        from gevent import get_hub
+
+        return get_hub().threadpool.apply(func, args)
+    return func(*args)
+
+
+# Timestamps are stored as naive UTC. SQLite's CURRENT_TIMESTAMP already is
+# UTC; PostgreSQL's follows the session time zone, so convert it explicitly.
+# The timestamp columns use utcnow() as both server_default and default:
+# SQLAlchemy writes the default into its INSERTs, so tables created before
+# the server defaults existed (and SQLite cannot add them later) still get
+# timestamps, computed by the database.
+UTC_NOW = {"postgresql": "TIMEZONE('utc', CURRENT_TIMESTAMP)"}
+
+
+def utc_now_sql(dialect):
+    return UTC_NOW.get(dialect.name, "CURRENT_TIMESTAMP")
+
+
+class utcnow(FunctionElement):
+    """The database's current time as naive UTC"""
+
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def compile_utcnow(element, compiler, **kw):
+    return utc_now_sql(compiler.dialect)
+
+
+class UTCText(TextClause):
+    """A text() statement in which :utcnow stands for utcnow()"""
+
+    inherit_cache = True
+
+
+@compiles(UTCText)
+def compile_utc_text(element, compiler, **kw):
+    sql = element.text.replace(":utcnow", utc_now_sql(compiler.dialect))
+    return compiler.process(db.text(sql), **kw)
+
 
 class User(db.Model, UserMixin):
     __tablename__ = "users"
+    # Fetch server-generated timestamps with RETURNING during the flush
+    __mapper_args__ = {"eager_defaults": True}
 
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(255), unique=True, nullable=False)
     email = db.Column(db.String(255), unique=True, nullable=False)
     password_hash = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Replaced whenever any of the user's lists or tasks change; serves as
+    # the ETag of GET /lists and the key of its cached payloads
+    lists_version = db.Column(db.String(32), default=lambda: uuid.uuid4().hex)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow()
     )
 
     # Relationship: A user has many lists
@@ -26,35 +98,60 @@ class User(db.Model, UserMixin):
 
     def set_password(self, password):
         """Hash and set the user's password"""
-        self.password_hash = bcrypt.generate_password_hash(password).decode("utf-8")
+        rounds = current_app.config["BCRYPT_LOG_ROUNDS"]
+        self.password_hash = run_blocking(
+            bcrypt.generate_password_hash, password, rounds
+        ).decode("utf-8")
 
     def check_password(self, password):
         """Check if provided password matches the hash"""
-        return bcrypt.check_password_hash(self.password_hash, password)
+        key = hmac.digest(
+            current_app.secret_key.encode(),
+            self.password_hash.encode() + b"\0" + password.encode(),
+            hashlib.blake2b,
+        )
+        with verified_passwords_lock:
+            if key in verified_passwords:
+                return True
+
+        if not run_blocking(bcrypt.check_password_hash, self.password_hash, password):
+            return False
+
+        with verified_passwords_lock:
+            verified_passwords[key] = True
+        return True
+
+    def password_needs_rehash(self):
+        """Check if the stored hash was made with a different bcrypt cost.
+        The cost is embedded in the hash itself, e.g. $2b$12$..."""
+        return int(self.password_hash[4:6]) != current_app.config["BCRYPT_LOG_ROUNDS"]
 
     def to_dict(self):
         return {
             "id": self.id,
             "username": self.username,
             "email": self.email,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
         }
 
 
 class List(db.Model):
     __tablename__ = "lists"
+    __mapper_args__ = {"eager_defaults": True}
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow()
     )
 
     # Foreign key to User - each list belongs to a user
-    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users.id"), nullable=False, index=True
+    )
 
     # Relationship: A list has many tasks (only top-level tasks)
     tasks = db.relationship(
@@ -65,26 +162,43 @@ class List(db.Model):
         foreign_keys="Task.list_id",
     )
 
-    def to_dict(self):
-        return {
+    def to_dict(self, include_tasks=True):
+        result = {
             "id": self.id,
             "name": self.name,
             "description": self.description,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
-            "tasks": [task.to_dict() for task in self.tasks if task.parent_id is None],
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
         }
+        if include_tasks:
+            result["tasks"] = [
+                task.to_dict() for task in self.tasks if task.parent_id is None
+            ]
+        return result
+
+    def to_dict_fast(self, tasks=None):
+        """Serialize the list like to_dict, but build the task tree from one
+        flat query instead of walking the ORM relationships.
+        Pass tasks to reuse a tree already fetched with task_trees()."""
+        if tasks is None:
+            tasks = task_trees([self.id])[self.id]
+        result = self.to_dict(include_tasks=False)
+        result["tasks"] = tasks
+        return result
 
 
 class Task(db.Model):
     __tablename__ = "tasks"
+    __mapper_args__ = {"eager_defaults": True}
+    # Serves both "all tasks of a list" and "children within a list" lookups
+    __table_args__ = (db.Index("ix_tasks_list_parent", "list_id", "parent_id"),)
 
     id = db.Column(db.Integer, primary_key=True)
     description = db.Column(db.Text, nullable=False)
     completed = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=utcnow(), server_default=utcnow())
     updated_at = db.Column(
-        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+        db.DateTime, default=utcnow(), server_default=utcnow(), onupdate=utcnow()
     )
 
     # Foreign key to the List model, indicating which list this task belongs to
@@ -93,7 +207,13 @@ class Task(db.Model):
     # Self-referential foreign key for hierarchical tasks
     # If parent_id is null, this is a top-level task
     # If parent_id has a value, this is a subtask of another task
-    parent_id = db.Column(db.Integer, db.ForeignKey("tasks.id"), nullable=True)
+    parent_id = db.Column(
+        db.Integer, db.ForeignKey("tasks.id"), nullable=True, index=True
+    )
+
+    # Depth in the hierarchy, stored at insert time so reading it never
+    # has to walk the parent chain (0 for top-level tasks)
+    depth = db.Column(db.SmallInteger, nullable=False, default=0)
 
     # Relationship: A task can have many subtasks
     subtasks = db.relationship(
@@ -104,15 +224,10 @@ class Task(db.Model):
     )
 
     def get_depth(self):
-        """Calculate the depth of the task in the hierarchy.
+        """Return the depth of the task in the hierarchy.
         A top-level task has a depth of 0,
         a subtask of a top-level task has a depth of 1, and so on."""
-        depth = 0
-        current_task = self
-        while current_task.parent is not None:
-            depth += 1
-            current_task = current_task.parent
-        return depth
+        return self.depth
 
     def can_have_subtasks(self):
         """Determine if the task can have subtasks.
@@ -120,42 +235,53 @@ class Task(db.Model):
         """
         return True
 
+    def can_move_to_list(self, new_list_id):
+        """Determine if the task can be moved to the given list.
+        Only top-level tasks move between lists; subtasks stay with their parent.
+        """
+        return self.parent_id is None or new_list_id == self.list_id
+
+    def _update_tree(self, statement, **params):
+        """Run one of the recursive UPDATEs below, which walk the hierarchy
+        from this task inside the database in a single statement.
+        Pending changes are flushed first so the walk sees them; loaded
+        tasks are expired afterwards since the UPDATE left them stale."""
+        db.session.flush()
+        db.session.execute(statement, {"task_id": self.id, **params})
+        db.session.expire_all()
+
     def set_completion_cascade(self, completed_status):
-        """Set completion status for this task and all its subtasks recursively."""
-        self.completed = completed_status
-        for subtask in self.subtasks:
-            subtask.set_completion_cascade(completed_status)
+        """Set completion status for this task and all its subtasks recursively"""
+        self._update_tree(update_subtree_completion, completed=completed_status)
+
+    def move_to_list(self, new_list_id):
+        """Move this task and all its subtasks to another list"""
+        self._update_tree(update_subtree_list, list_id=new_list_id)
 
     def update_parent_completion(self):
         """Check if all siblings are complete and update parent accordingly.
-        This should be called after a task's completion status changes."""
-        if self.parent is None:
+        This should be called after a task's completion status changes.
+
+        The whole walk up the hierarchy runs as a single UPDATE: each ancestor
+        is complete only if the child we came from and all its other children
+        are, and the walk stops at the first ancestor whose status is unchanged."""
+        if self.parent_id is None:
             # This is a top-level task, no parent to update
             return
 
-        # Check if all siblings (including self) are complete
-        all_siblings_complete = all(
-            sibling.completed for sibling in self.parent.subtasks
+        self._update_tree(
+            update_ancestors_completion,
+            parent_id=self.parent_id,
+            completed=bool(self.completed),
         )
 
-        if all_siblings_complete and not self.parent.completed:
-            # All subtasks are complete, mark parent as complete
-            self.parent.completed = True
-            # Recursively check the parent's parent
-            self.parent.update_parent_completion()
-        elif not all_siblings_complete and self.parent.completed:
-            # At least one subtask is incomplete, mark parent as incomplete
-            self.parent.completed = False
-            # Recursively check the parent's parent
-            self.parent.update_parent_completion()
-
     def to_dict(self, include_subtasks=True):
         result = {
             "id": self.id,
             "description": self.description,
             "completed": self.completed,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat(),
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
             "depth": self.get_depth(),
             "can_have_subtasks": self.can_have_subtasks(),
         }
@@ -164,3 +290,136 @@ class Task(db.Model):
                 subtask.to_dict(include_subtasks=True) for subtask in self.subtasks
             ]
         return result
+
+
+# Set the completion status of a task and every task below it
+update_subtree_completion = UTCText(
+    """
+    WITH RECURSIVE subtree(id) AS (
+        SELECT id FROM tasks WHERE id = :task_id
+        UNION ALL
+        SELECT t.id FROM tasks t JOIN subtree s ON t.parent_id = s.id
+    )
+    UPDATE tasks
+    SET completed = :completed, updated_at = :utcnow
+    WHERE id IN (SELECT id FROM subtree)
+    AND COALESCE(completed, FALSE) <> :completed
+    """
+)
+
+# Move a task and every task below it to another list
+update_subtree_list = UTCText(
+    """
+    WITH RECURSIVE subtree(id) AS (
+        SELECT id FROM tasks WHERE id = :task_id
+        UNION ALL
+        SELECT t.id FROM tasks t JOIN subtree s ON t.parent_id = s.id
+    )
+    UPDATE tasks
+    SET list_id = :list_id, updated_at = :utcnow
+    WHERE id IN (SELECT id FROM subtree)
+    """
+)
+
+# Walk up from a task's parent, recomputing each ancestor's completion from
+# the child we came from plus that ancestor's other children
+update_ancestors_completion = UTCText(
+    """
+    WITH RECURSIVE ancestors(id, parent_id, was_completed, completed) AS (
+        SELECT p.id, p.parent_id, COALESCE(p.completed, FALSE),
+               :completed AND NOT EXISTS (
+                   SELECT 1 FROM tasks c
+                   WHERE c.parent_id = p.id AND c.id <> :task_id
+                   AND c.completed IS NOT TRUE
+               )
+        FROM tasks p
+        WHERE p.id = :parent_id
+        UNION ALL
+        SELECT p.id, p.parent_id, COALESCE(p.completed, FALSE),
+               a.completed AND NOT EXISTS (
+                   SELECT 1 FROM tasks c
+                   WHERE c.parent_id = p.id AND c.id <> a.id
+                   AND c.completed IS NOT TRUE
+               )
+        FROM tasks p
+        JOIN ancestors a ON p.id = a.parent_id
+        WHERE a.completed <> a.was_completed
+    )
+    UPDATE tasks
+    SET completed = (SELECT a.completed FROM ancestors a WHERE a.id = tasks.id),
+        updated_at = :utcnow
+    WHERE id IN (SELECT id FROM ancestors WHERE completed <> was_completed)
+    """
+)
+
+
+@dataclass
+class TaskNode:
+    """A serialized task, shaped like Task.to_dict().
+    orjson encodes dataclasses natively, so a tree of these is written out
+    without building an intermediate dict per task."""
+
+    id: int
+    description: str
+    completed: bool
+    created_at: datetime
+    updated_at: datetime
+    depth: int
+    can_have_subtasks: bool = True
+    subtasks: list = field(default_factory=list)
+
+
+def task_trees(list_ids):
+    """Fetch every task of the given lists with a single query and nest them
+    in Python. Returns a dict mapping each list id to its top-level tasks
+    as TaskNode trees."""
+    trees = {list_id: [] for list_id in list_ids}
+    if not trees:
+        return trees
+
+    columns = Task.__table__.c
+    rows = db.session.execute(
+        db.select(
+            columns.id,
+            columns.list_id,
+            columns.parent_id,
+            columns.description,
+            columns.completed,
+            columns.created_at,
+            columns.updated_at,
+            columns.depth,
+        )
+        .where(columns.list_id.in_(list_ids))
+        .order_by(columns.id)
+    ).all()
+
+    nodes = {
+        row.id: TaskNode(
+            row.id,
+            row.description,
+            row.completed,
+            row.created_at,
+            row.updated_at,
+            row.depth,
+        )
+        for row in rows
+    }
+    for row in rows:
+        if row.parent_id is None:
+            trees[row.list_id].append(nodes[row.id])
+        elif row.parent_id in nodes:
+            nodes[row.parent_id].subtasks.append(nodes[row.id])
+        # Older releases moved a task without its subtasks, leaving them in
+        # a list their parent is not in; init_db.py moves them back
+    return trees
+
+
+@db.event.listens_for(Task, "before_insert")
+def set_task_depth(mapper, connection, target):
+    """Fill in the depth of subtasks inserted without one.
+    Routes set it from the already-loaded parent; this covers everything else."""
+    if target.depth is None and target.parent_id is not None:
+        parent_depth = connection.scalar(
+            db.select(Task.depth).where(Task.id == target.parent_id)
+        )
+        target.depth = parent_depth + 1
@@ -1,16 +1,50 @@
-from flask import Blueprint, request, jsonify
+import uuid
+from threading import Lock
+from cachetools import LRUCache
+from flask import Blueprint, current_app, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, List, Task
+from sqlalchemy import insert, update
+from sqlalchemy.orm import selectinload
+from models import db, User, List, Task, TaskNode, task_trees
 
 # Create a blueprint for API routes
 api = Blueprint("api", __name__)
 
+# Serialized GET /lists bodies keyed by the owner's lists_version,
+# capped at 32 MB in total
+lists_payloads = LRUCache(maxsize=32 * 1024 * 1024, getsizeof=len)
+lists_payloads_lock = Lock()
+
+
+def current_user_id():
+    """Return the authenticated user's id as an int (the JWT subject is a
+    string)"""
+    return int(get_jwt_identity())
+
+
+def touch_lists(user_id, session=None):
+    """Give the user's lists a new version, retiring cached GET /lists bodies.
+    Call before committing any change to the user's lists or tasks; session
+    defaults to db.session."""
+    (session or db.session).execute(
+        update(User)
+        .where(User.id == user_id)
+        # Keep updated_at: the account itself has not changed
+        .values(lists_version=uuid.uuid4().hex, updated_at=User.updated_at)
+        .execution_options(synchronize_session=False)
+    )
+
+
+# Eager-load a list's entire task tree: one IN query per level of nesting
+# instead of one lazy SELECT per task (used where the ORM has to walk it)
+task_tree = selectinload(List.tasks).selectinload(Task.subtasks, recursion_depth=-1)
+
 
 # List endpoints
 @api.route("/lists", methods=["GET", "POST"])
 @jwt_required()
 def lists():
-    user_id = int(get_jwt_identity())  # Convert string to int
+    user_id = current_user_id()
     print(user_id, request.method)
 
     if request.method == "POST":
@@ -22,26 +56,46 @@ def lists():
             user_id=user_id,
         )
         db.session.add(new_list)
+        touch_lists(user_id)
         db.session.commit()
         return jsonify(new_list.to_dict()), 201
 
-    # GET all lists belonging to the current user
-    user_lists = List.query.filter_by(user_id=user_id).all()
-    return jsonify([lst.to_dict() for lst in user_lists])
+    # GET all lists belonging to the current user. While nothing has changed
+    # the body comes from the cache, or the client gets a 304 for its ETag
+    version = db.session.scalar(db.select(User.lists_version).where(User.id == user_id))
+    with lists_payloads_lock:
+        body = lists_payloads.get(version)
+
+    if body is None:
+        user_lists = List.query.filter_by(user_id=user_id).all()
+        trees = task_trees([lst.id for lst in user_lists])
+        body = current_app.json.dumps(
+            [lst.to_dict_fast(trees[lst.id]) for lst in user_lists]
+        )
+        if version is not None:
+            with lists_payloads_lock:
+                lists_payloads[version] = body
+
+    response = current_app.response_class(body, mimetype="application/json")
+    if version is not None:
+        response.set_etag(version)
+    return response.make_conditional(request)
 
 
 @api.route("/lists/<int:list_id>", methods=["GET", "PUT", "DELETE"])
 @jwt_required()
 def list_detail(list_id):
-    user_id = int(get_jwt_identity())  # Convert string to int
-    list_obj = List.query.get_or_404(list_id)
-
-    # Ensure the list belongs to the current user
-    if list_obj.user_id != user_id:
-        return jsonify({"error": "Unauthorized access to this list"}), 403
+    user_id = current_user_id()
+    # Only find the list if it belongs to the current user
+    query = List.query.filter_by(id=list_id, user_id=user_id)
+    if request.method == "DELETE":
+        # Deleting cascades through every task, so load the whole tree at once
+        query = query.options(task_tree)
+    list_obj = query.first_or_404()
 
     if request.method == "DELETE":
         db.session.delete(list_obj)
+        touch_lists(user_id)
         db.session.commit()
         return "", 204
 
@@ -49,68 +103,146 @@ def list_detail(list_id):
         data = request.get_json()
         list_obj.name = data.get("name", list_obj.name)
         list_obj.description = data.get("description", list_obj.description)
+        touch_lists(user_id)
         db.session.commit()
 
-    return jsonify(list_obj.to_dict())
+    return jsonify(list_obj.to_dict_fast())
 
 
 # Task endpoints
 @api.route("/lists/<int:list_id>/tasks", methods=["POST"])
 @jwt_required()
 def create_task(list_id):
-    user_id = int(get_jwt_identity())  # Convert string to int
-    list_obj = List.query.get_or_404(list_id)
-
-    # Ensure the list belongs to the current user
-    if list_obj.user_id != user_id:
-        return jsonify({"error": "Unauthorized access to this list"}), 403
+    user_id = current_user_id()
+    # Only find the list if it belongs to the current user
+    List.query.filter_by(id=list_id, user_id=user_id).first_or_404()
 
     data = request.get_json()
-    new_task = Task(
-        description=data["description"],
-        list_id=list_id,
-        completed=data.get("completed", False),
+    description = data["description"]
+    completed = data.get("completed", False)
+    if not isinstance(completed, bool):
+        return jsonify({"error": "Completed must be true or false"}), 400
+    # INSERT ... RETURNING hands back the generated columns in the same
+    # round-trip, so the response needs no reload after commit
+    row = db.session.execute(
+        insert(Task)
+        .values(description=description, completed=completed, list_id=list_id)
+        .returning(Task.id, Task.created_at, Task.updated_at)
+    ).one()
+    touch_lists(user_id)
+    db.session.commit()
+    new_task = TaskNode(
+        row.id, description, completed, row.created_at, row.updated_at, 0
     )
-    db.session.add(new_task)
+    return jsonify(new_task), 201
+
+
+@api.route("/lists/<int:list_id>/tasks/bulk", methods=["POST"])
+@jwt_required()
+def create_tasks_bulk(list_id):
+    """Create a whole tree of tasks in one transaction.
+    Expects a JSON array of {"description", "completed", "subtasks": [...]}."""
+    user_id = current_user_id()
+    # Only find the list if it belongs to the current user
+    list_obj = List.query.filter_by(id=list_id, user_id=user_id).first_or_404()
+
+    data = request.get_json()
+    if not isinstance(data, list):
+        return jsonify({"error": "Expected a list of tasks"}), 400
+
+    # Validate the whole tree before inserting anything
+    pending = list(data)
+    while pending:
+        node = pending.pop()
+        if not isinstance(node, dict) or not node.get("description"):
+            return jsonify({"error": "Every task needs a description"}), 400
+        if not isinstance(node.get("subtasks", []), list):
+            return jsonify({"error": "Subtasks must be a list of tasks"}), 400
+        if not isinstance(node.get("completed", False), bool):
+            return jsonify({"error": "Completed must be true or false"}), 400
+        pending.extend(node.get("subtasks", []))
+
+    # Insert one level of the tree per statement; the ids returned for a
+    # level become the parent ids of the level below it
+    level = [(None, node) for node in data]
+    depth = 0
+    while level:
+        task_ids = db.session.scalars(
+            insert(Task).returning(Task.id, sort_by_parameter_order=True),
+            [
+                {
+                    "description": node["description"],
+                    "completed": node.get("completed", False),
+                    "list_id": list_id,
+                    "parent_id": parent_id,
+                    "depth": depth,
+                }
+                for parent_id, node in level
+            ],
+        ).all()
+        level = [
+            (task_id, subtask)
+            for task_id, (_, node) in zip(task_ids, level)
+            for subtask in node.get("subtasks", [])
+        ]
+        depth += 1
+
+    touch_lists(user_id)
     db.session.commit()
-    return jsonify(new_task.to_dict()), 201
+    return jsonify(list_obj.to_dict_fast()), 201
 
 
 @api.route("/tasks/<int:task_id>/subtasks", methods=["POST"])
 @jwt_required()
 def create_subtask(task_id):
-    user_id = int(get_jwt_identity())  # Convert string to int
-    parent_task = Task.query.get_or_404(task_id)
-
-    # Ensure the parent task's list belongs to the current user
-    if parent_task.list.user_id != user_id:
-        return jsonify({"error": "Unauthorized access to this task"}), 403
+    user_id = current_user_id()
+    # Only find the parent task if its list belongs to the current user
+    parent_task = (
+        Task.query.join(List, Task.list_id == List.id)
+        .filter(Task.id == task_id, List.user_id == user_id)
+        .first_or_404()
+    )
 
     # Infinite nesting allowed - no depth limit
     data = request.get_json()
-    new_subtask = Task(
-        description=data["description"],
-        parent_id=task_id,
-        list_id=parent_task.list_id,
-        completed=data.get("completed", False),
-    )
-    db.session.add(new_subtask)
+    description = data["description"]
+    completed = data.get("completed", False)
+    if not isinstance(completed, bool):
+        return jsonify({"error": "Completed must be true or false"}), 400
+    depth = parent_task.depth + 1
+    row = db.session.execute(
+        insert(Task)
+        .values(
+            description=description,
+            completed=completed,
+            parent_id=task_id,
+            list_id=parent_task.list_id,
+            depth=depth,
+        )
+        .returning(Task.id, Task.created_at, Task.updated_at)
+    ).one()
+    touch_lists(user_id)
     db.session.commit()
-    return jsonify(new_subtask.to_dict()), 201
+    new_subtask = TaskNode(
+        row.id, description, completed, row.created_at, row.updated_at, depth
+    )
+    return jsonify(new_subtask), 201
 
 
 @api.route("/tasks/<int:task_id>", methods=["GET", "PUT", "DELETE"])
 @jwt_required()
 def task_detail(task_id):
-    user_id = int(get_jwt_identity())  # Convert string to int
-    task = Task.query.get_or_404(task_id)
-
-    # Ensure the task's list belongs to the current user
-    if task.list.user_id != user_id:
-        return jsonify({"error": "Unauthorized access to this task"}), 403
+    user_id = current_user_id()
+    # Only find the task if its list belongs to the current user
+    task = (
+        Task.query.join(List, Task.list_id == List.id)
+        .filter(Task.id == task_id, List.user_id == user_id)
+        .first_or_404()
+    )
 
     if request.method == "DELETE":
         db.session.delete(task)
+        touch_lists(user_id)
         db.session.commit()
         return "", 204
 
@@ -121,6 +253,8 @@ def task_detail(task_id):
         # Handle completion with cascade option
         if "completed" in data:
             new_status = data["completed"]
+            if not isinstance(new_status, bool):
+                return jsonify({"error": "Completed must be true or false"}), 400
             cascade = data.get("cascade", False)
 
             if cascade:
@@ -137,19 +271,27 @@ def task_detail(task_id):
         if "list_id" in data:
             new_list_id = data["list_id"]
             # Verify the new list exists and belongs to the user
-            new_list = List.query.get_or_404(new_list_id)
-            if new_list.user_id != user_id:
-                return jsonify({"error": "Unauthorized access to target list"}), 403
+            List.query.filter_by(id=new_list_id, user_id=user_id).first_or_404()
 
             # Only allow moving top-level tasks (tasks without a parent)
-            if task.parent_id is not None:
+            if not task.can_move_to_list(new_list_id):
                 return (
                     jsonify({"error": "Can only move top-level tasks between lists"}),
                     400,
                 )
 
-            task.list_id = new_list_id
+            # Subtasks follow their parent, so list trees stay whole
+            task.move_to_list(new_list_id)
 
+        touch_lists(user_id)
         db.session.commit()
 
+        # Let clients see an auto-(un)completed parent without another GET
+        if request.args.get("include") == "parent":
+            result = task.to_dict()
+            result["parent"] = (
+                task.parent.to_dict(include_subtasks=False) if task.parent else None
+            )
+            return jsonify(result)
+
     return jsonify(task.to_dict())
@@ -3,55 +3,293 @@ Pytest configuration for backend tests
 Provides fixtures and setup for all test modules
 """
 
-import sys
-import os
-
-# Add the parent directory (backend) to the path so we can import app modules
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+from contextlib import contextmanager
+from types import SimpleNamespace
 
 import pytest
-from models import db
+from sqlalchemy import event, insert
+from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import StaticPool
+from flask_jwt_extended import create_access_token
+from models import db, User, List, Task
+from routes import touch_lists
 from app import create_app
 
 
-@pytest.fixture
-def app():
-    """Create and configure a test app instance"""
-    app = create_app()
-    app.config["TESTING"] = True
-    app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///:memory:"
-    app.config["JWT_SECRET_KEY"] = "test-secret-key"
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers",
+        "query_budget(n): fail if the query_budget blocks run more than n statements",
+    )
 
-    with app.app_context():
-        db.create_all()
-        yield app
-        db.session.remove()
-        db.drop_all()
 
+TRANSACTION_CONTROL = ("BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
 
-@pytest.fixture
-def client(app):
-    """Create a test client"""
-    return app.test_client()
+
+@contextmanager
+def count_queries(queries=None):
+    """Collect the SQL statements run on the database inside the block.
+    Transaction control (BEGIN, SAVEPOINT, ...) is not counted."""
+    queries = [] if queries is None else queries
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        if not statement.lstrip().upper().startswith(TRANSACTION_CONTROL):
+            queries.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
 
 
 @pytest.fixture
-def auth_headers(client):
-    """Create a user and return auth headers with JWT token"""
-    # Register a user
-    client.post(
-        "/api/auth/register",
-        json={
-            "username": "testuser",
-            "email": "test@example.com",
-            "password": "password123",
-        },
+def query_budget(request):
+    """Count the statements run inside `with query_budget():` blocks and fail
+    the test if they exceed the n of its query_budget(n) marker"""
+    marker = request.node.get_closest_marker("query_budget")
+    assert marker is not None, "query_budget needs a @pytest.mark.query_budget(n)"
+    budget = marker.args[0]
+    queries = []
+
+    yield lambda: count_queries(queries)
+
+    assert (
+        len(queries) <= budget
+    ), f"{len(queries)} queries exceed the budget of {budget}:\n" + "\n".join(queries)
+
+
+@pytest.fixture(scope="session")
+def make_app():
+    """Return a factory that builds one app per distinct config and hands
+    the same instance back for repeated requests with that config"""
+    apps = {}
+
+    def make_app(config):
+        # Engine options hold unhashable values, so key on the repr
+        key = repr(sorted(config.items()))
+        if key not in apps:
+            apps[key] = create_app(config)
+        return apps[key]
+
+    return make_app
+
+
+@pytest.fixture(scope="session")
+def app(make_app):
+    """Create the test app and its schema once for the whole run"""
+    app = make_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+            # Every checkout shares one connection, and with it one database
+            "SQLALCHEMY_ENGINE_OPTIONS": {
+                "poolclass": StaticPool,
+                "connect_args": {"check_same_thread": False},
+                "echo": False,
+            },
+            # No per-commit modification events or per-query recording
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "SQLALCHEMY_RECORD_QUERIES": False,
+            "PROPAGATE_EXCEPTIONS": True,
+        }
     )
 
-    # Login and get token
-    response = client.post(
-        "/api/auth/login", json={"email": "test@example.com", "password": "password123"}
+    # One app context for the whole run; tests only push request contexts
+    ctx = app.app_context()
+    ctx.push()
+
+    # pysqlite only emits BEGIN before the first write, so a SAVEPOINT
+    # would start (and its RELEASE commit) the transaction on its own
+    @event.listens_for(db.engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    # Skip SQLite's durability work on the throwaway in-memory database
+    @event.listens_for(db.engine, "connect")
+    def set_test_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(db.engine, "begin")
+    def begin_transaction(connection):
+        connection.exec_driver_sql("BEGIN")
+
+    db.create_all()
+    yield app
+
+    ctx.pop()
+
+
+@pytest.fixture(scope="module")
+def connection(app, auth_user):
+    """Hold one connection per module inside a transaction that is rolled
+    back at the end, so module-scoped rows never leak into other modules.
+    auth_user commits on the same shared connection, so it is created
+    before the first module transaction opens."""
+    connection = db.engine.connect()
+    transaction = connection.begin()
+
+    yield connection
+
+    transaction.rollback()
+    connection.close()
+
+
+def make_session(connection):
+    """Create a session whose commits only release a SAVEPOINT.
+    Tests inspect what they just wrote, so commits leave instances loaded."""
+    return scoped_session(
+        sessionmaker(
+            bind=connection,
+            join_transaction_mode="create_savepoint",
+            expire_on_commit=False,
+            query_cls=db.Query,
+        )
     )
 
-    token = response.json["access_token"]
-    return {"Authorization": f"Bearer {token}"}
+
+@pytest.fixture(scope="module")
+def module_session(connection):
+    """Session for module-scoped fixtures; what they commit stays visible
+    to every test in the module"""
+    session = make_session(connection)
+    yield session
+    session.remove()
+
+
+@pytest.fixture(autouse=True)
+def db_session(connection, monkeypatch):
+    """Run every test in a SAVEPOINT that is rolled back afterwards.
+    db.session is swapped out, so the app's own commits land in it too."""
+    savepoint = connection.begin_nested()
+    session = make_session(connection)
+    monkeypatch.setattr(db, "session", session)
+
+    yield session
+
+    session.remove()
+    savepoint.rollback()
+
+
+@pytest.fixture(scope="session")
+def session_client(app):
+    """Create one test client for the whole run. The API authenticates with
+    headers rather than cookies, so the client carries no state between tests."""
+    return app.test_client(use_cookies=False)
+
+
+@pytest.fixture
+def client(session_client, db_session):
+    """Return the shared test client, with the test's SAVEPOINT in place"""
+    return session_client
+
+
+@pytest.fixture(scope="session")
+def auth_user(app):
+    """Create the user the route tests act as, once for the whole run.
+    It is committed outside every test transaction, so it outlives their
+    rollbacks; the auth tests register testuser, so it needs other details."""
+    user = User(username="fixtureuser", email="fixture@example.com")
+    user.set_password("password123")
+    db.session.add(user)
+    db.session.commit()
+    user_id = user.id
+    db.session.remove()
+    return user_id
+
+
+@pytest.fixture(scope="session")
+def jwt_token(app, auth_user):
+    """Mint a JWT for auth_user once for the whole run, directly rather than
+    through the register and login endpoints"""
+    return create_access_token(identity=str(auth_user))
+
+
+@pytest.fixture(scope="session")
+def auth_headers(jwt_token):
+    """Return auth headers carrying auth_user's JWT"""
+    return {"Authorization": f"Bearer {jwt_token}"}
+
+
+@pytest.fixture(scope="session")
+def insert_task_tree():
+    """Return a helper that inserts a nested {name: {child name: ...}} tree
+    of tasks into a list, using each name as the description, and returns
+    their ids by name. The caller commits."""
+
+    def insert_task_tree(session, list_id, tree):
+        # Pick the ids up front so the whole tree goes in as one INSERT
+        # (bulk inserts skip the depth listener, so depths are given too)
+        next_id = (session.scalar(db.select(db.func.max(Task.id))) or 0) + 1
+        ids = {}
+        rows = []
+        # Breadth first, so ids grow level by level like the bulk endpoint's
+        level = [(None, tree)]
+        depth = 0
+        while level:
+            next_level = []
+            for parent_id, subtree in level:
+                for name, children in subtree.items():
+                    ids[name] = next_id
+                    rows.append(
+                        {
+                            "id": next_id,
+                            "description": name,
+                            "list_id": list_id,
+                            "parent_id": parent_id,
+                            "depth": depth,
+                        }
+                    )
+                    next_level.append((next_id, children))
+                    next_id += 1
+            level = next_level
+            depth += 1
+
+        session.execute(insert(Task), rows)
+        return ids
+
+    return insert_task_tree
+
+
+@pytest.fixture
+def seed(db_session, auth_user):
+    """Return helpers that insert lists and tasks for auth_user through the
+    ORM and return their ids, for tests whose subject is not the create
+    endpoints"""
+
+    def commit(*objs):
+        db_session.add_all(objs)
+        # GET /lists is cached per lists_version, so seeded rows bump it too
+        touch_lists(auth_user)
+        db_session.commit()
+        return [obj.id for obj in objs]
+
+    def make_list(name, description=None):
+        (list_id,) = commit(List(name=name, description=description, user_id=auth_user))
+        return list_id
+
+    def make_tasks(list_id, descriptions, parent_id=None, completed=False):
+        """Insert sibling tasks in a single commit and return their ids"""
+        return commit(
+            *(
+                Task(
+                    description=description,
+                    list_id=list_id,
+                    parent_id=parent_id,
+                    completed=completed,
+                )
+                for description in descriptions
+            )
+        )
+
+    def make_task(list_id, description, parent_id=None, completed=False):
+        (task_id,) = make_tasks(list_id, [description], parent_id, completed)
+        return task_id
+
+    return SimpleNamespace(
+        make_list=make_list, make_task=make_task, make_tasks=make_tasks
+    )
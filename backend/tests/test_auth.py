@@ -3,8 +3,13 @@ Unit tests for authentication routes (auth.py)
 Tests user registration, login, and authentication flows
 """
 
+import re
+
 import pytest
 
+# One base64url segment of a JWT
+JWT_PART = re.compile(r"\A[A-Za-z0-9_-]+\Z")
+
 
 class TestAuthRoutes:
     """Test cases for authentication routes"""
@@ -21,13 +26,14 @@ class TestAuthRoutes:
         )
 
         assert response.status_code == 201
-        assert "access_token" in response.json
-        assert "user" in response.json
-        assert response.json["user"]["username"] == "newuser"
-        assert response.json["user"]["email"] == "new@example.com"
+        body = response.get_json()
+        assert "access_token" in body
+        assert "user" in body
+        assert body["user"]["username"] == "newuser"
+        assert body["user"]["email"] == "new@example.com"
         # Password should NOT be in response
-        assert "password" not in response.json["user"]
-        assert "password_hash" not in response.json["user"]
+        assert "password" not in body["user"]
+        assert "password_hash" not in body["user"]
 
     def test_register_duplicate_username(self, client):
         """Test registration with duplicate username fails"""
@@ -52,8 +58,9 @@ class TestAuthRoutes:
         )
 
         assert response.status_code == 400
-        assert "error" in response.json
-        assert "already exists" in response.json["error"].lower()
+        body = response.get_json()
+        assert "error" in body
+        assert "already exists" in body["error"].lower()
 
     def test_register_duplicate_email(self, client):
         """Test registration with duplicate email fails"""
@@ -78,8 +85,9 @@ class TestAuthRoutes:
         )
 
         assert response.status_code == 400
-        assert "error" in response.json
-        assert "email" in response.json["error"].lower()
+        body = response.get_json()
+        assert "error" in body
+        assert "email" in body["error"].lower()
 
     def test_register_missing_username(self, client):
         """Test registration fails with missing username"""
@@ -142,12 +150,39 @@ class TestAuthRoutes:
         )
 
         assert response.status_code == 200
-        assert "access_token" in response.json
-        assert "user" in response.json
-        assert response.json["message"] == "Login successful"
+        body = response.get_json()
+        assert "access_token" in body
+        assert "user" in body
+        assert body["message"] == "Login successful"
         # Verify token is a non-empty string
-        assert isinstance(response.json["access_token"], str)
-        assert len(response.json["access_token"]) > 20
+        assert isinstance(body["access_token"], str)
+        assert len(body["access_token"]) > 20
+
+    def test_login_rehashes_password_with_new_cost(self, client, app, monkeypatch):
+        """Test that login upgrades a hash made with an outdated bcrypt cost"""
+        from models import User
+
+        client.post(
+            "/api/auth/register",
+            json={
+                "username": "rehashuser",
+                "email": "rehash@example.com",
+                "password": "password123",
+            },
+        )
+
+        # The app is shared by the whole run, so restore the cost afterwards
+        monkeypatch.setitem(app.config, "BCRYPT_LOG_ROUNDS", 5)
+        response = client.post(
+            "/api/auth/login",
+            json={"email": "rehash@example.com", "password": "password123"},
+        )
+
+        assert response.status_code == 200
+        with app.app_context():
+            user = User.query.filter_by(email="rehash@example.com").first()
+            assert user.password_hash[4:6] == "05"
+            assert user.check_password("password123") is True
 
     def test_login_wrong_password(self, client):
         """Test login fails with wrong password"""
@@ -230,7 +265,7 @@ class TestAuthRoutes:
         assert len(parts) == 3
         # Each part should be base64 encoded (alphanumeric + - _)
         for part in parts:
-            assert part.replace("-", "").replace("_", "").isalnum()
+            assert JWT_PART.match(part)
 
     def test_register_creates_user_in_database(self, client, app):
         """Test that registration actually creates a user in the database"""
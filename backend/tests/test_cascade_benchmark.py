@@ -0,0 +1,86 @@
+"""
+Benchmarks for the completion walks in models.py
+Times the subtree cascade and the ancestor walk on a seeded task tree
+"""
+
+from itertools import count
+
+import pytest
+from sqlalchemy import update
+from models import db, List, Task
+
+pytest.importorskip("pytest_benchmark")
+
+DEPTH = 4
+FAN_OUT = 5
+
+# Warmup rounds absorb SQLAlchemy's first-use statement compilation, so the
+# timed rounds measure the walk at steady state. Rounds that take a setup
+# function must run one iteration each.
+PEDANTIC = {"rounds": 30, "warmup_rounds": 5, "iterations": 1}
+
+
+@pytest.fixture(scope="module")
+def benchmark_tree(module_session, auth_user, insert_task_tree):
+    """Seed a DEPTH-deep tree with FAN_OUT children per task once per module.
+    Returns the root id and the id of one leaf at the bottom of the tree."""
+    list_obj = List(name="Benchmark", user_id=auth_user)
+    module_session.add(list_obj)
+    module_session.flush()
+
+    names = count(1)
+
+    def subtree(depth):
+        if depth > DEPTH:
+            return {}
+        return {f"Task {next(names)}": subtree(depth + 1) for _ in range(FAN_OUT)}
+
+    ids = insert_task_tree(module_session, list_obj.id, {"Root": subtree(1)})
+    module_session.commit()
+    # Ids are handed out level by level, so the last one is a bottom leaf
+    return ids["Root"], list(ids.values())[-1]
+
+
+def set_tree_completion(list_id, completed):
+    db.session.execute(
+        update(Task).where(Task.list_id == list_id).values(completed=completed)
+    )
+    db.session.expire_all()
+
+
+def test_cascade_completion_benchmark(benchmark, benchmark_tree):
+    """Time completing the whole tree from its root"""
+    root_id, _ = benchmark_tree
+    root = db.session.get(Task, root_id)
+
+    benchmark.pedantic(
+        root.set_completion_cascade,
+        args=(True,),
+        setup=lambda: set_tree_completion(root.list_id, False),
+        **PEDANTIC,
+    )
+
+    incomplete = db.session.scalar(
+        db.select(db.func.count()).where(
+            Task.list_id == root.list_id, Task.completed.is_(False)
+        )
+    )
+    assert incomplete == 0
+
+
+def test_auto_uncomplete_benchmark(benchmark, benchmark_tree):
+    """Time unchecking a leaf and walking the change up to the root"""
+    root_id, leaf_id = benchmark_tree
+    leaf = db.session.get(Task, leaf_id)
+
+    def uncheck_leaf():
+        leaf.completed = False
+        leaf.update_parent_completion()
+
+    benchmark.pedantic(
+        uncheck_leaf,
+        setup=lambda: set_tree_completion(leaf.list_id, True),
+        **PEDANTIC,
+    )
+
+    assert db.session.get(Task, root_id).completed is False
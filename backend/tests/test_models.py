@@ -3,441 +3,438 @@ Unit tests for database models
 Tests User, List, and Task models including relationships and methods
 """
 import pytest
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.orm import raiseload, selectinload
 from models import db, User, List, Task
-from app import create_app
+from routes import task_tree
 
 
 @pytest.fixture
-def app():
-    """Create and configure a test app instance"""
-    app = create_app()
-    app.config['TESTING'] = True
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
-    app.config['JWT_SECRET_KEY'] = 'test-secret-key'
+def no_lazy_loads(db_session):
+    """Make lazy relationship loads raise, so N+1 queries fail the test"""
+    def add_raiseload(execute_state):
+        if (
+            execute_state.is_select
+            and not execute_state.is_column_load
+            and not execute_state.is_relationship_load
+        ):
+            execute_state.statement = execute_state.statement.options(
+                raiseload('*')
+            )
     
-    with app.app_context():
-        db.create_all()
-        yield app
-        db.session.remove()
-        db.drop_all()
+    event.listen(db_session, 'do_orm_execute', add_raiseload)
 
 
-@pytest.fixture
-def client(app):
-    """Create a test client"""
-    return app.test_client()
+@pytest.fixture(scope='module')
+def sample_user_nopw(module_session):
+    """Create a sample user once per module and return its id.
+    No test signs in as this user, so it skips password hashing."""
+    user = User(username="testuser", email="test@example.com")
+    user.password_hash = "dummy_hash_placeholder_12345678"
+    module_session.add(user)
+    module_session.commit()
+    return user.id
 
 
-@pytest.fixture
-def sample_user(app):
-    """Create a sample user for testing"""
-    with app.app_context():
-        user = User(username="testuser", email="test@example.com")
-        user.set_password("password123")
-        db.session.add(user)
-        db.session.commit()
-        return user
+@pytest.fixture(scope='module')
+def sample_list(module_session, sample_user_nopw):
+    """Create a sample list once per module and return its id"""
+    list_obj = List(
+        name="Test List",
+        description="Test Description",
+        user_id=sample_user_nopw
+    )
+    module_session.add(list_obj)
+    module_session.commit()
+    return list_obj.id
 
 
-@pytest.fixture
-def sample_list(app, sample_user):
-    """Create a sample list for testing"""
-    with app.app_context():
-        user = db.session.merge(sample_user)
-        list_obj = List(
-            name="Test List",
-            description="Test Description",
-            user_id=user.id
-        )
-        db.session.add(list_obj)
-        db.session.commit()
-        return list_obj
+@pytest.fixture(scope='module')
+def sample_task(module_session, sample_list):
+    """Create a sample task once per module and return its id"""
+    task = Task(description="Test Task", list_id=sample_list)
+    module_session.add(task)
+    module_session.commit()
+    return task.id
+
+
+@pytest.fixture(scope='module')
+def task_hierarchy(module_session, sample_user_nopw, insert_task_tree):
+    """Create grandparent -> parent -> (child1, child2) in a list of its own
+    once per module and return their ids by name"""
+    list_obj = List(name="Hierarchy", user_id=sample_user_nopw)
+    module_session.add(list_obj)
+    module_session.flush()
+    
+    ids = insert_task_tree(module_session, list_obj.id, {
+        'grandparent': {'parent': {'child1': {}, 'child2': {}}},
+    })
+    module_session.commit()
+    return ids
 
 
 class TestUserModel:
     """Test cases for User model"""
     
-    def test_user_creation(self, app):
+    def test_user_creation(self):
         """Test creating a new user"""
-        with app.app_context():
-            user = User(username="newuser", email="new@example.com")
-            user.set_password("password123")
-            db.session.add(user)
-            db.session.commit()
-            
-            assert user.id is not None
-            assert user.username == "newuser"
-            assert user.email == "new@example.com"
-            assert user.password_hash is not None
+        user = User(username="newuser", email="new@example.com")
+        user.set_password("password123")
+        db.session.add(user)
+        db.session.commit()
+        
+        assert user.id is not None
+        assert user.username == "newuser"
+        assert user.email == "new@example.com"
+        assert user.password_hash is not None
     
-    def test_password_hashing(self, app):
+    def test_password_hashing(self):
         """Test that passwords are properly hashed"""
-        with app.app_context():
-            user = User(username="hashtest", email="hash@example.com")
-            user.set_password("mypassword")
-            
-            # Password should be hashed, not stored as plain text
-            assert user.password_hash != "mypassword"
-            assert len(user.password_hash) > 20
+        user = User(username="hashtest", email="hash@example.com")
+        user.set_password("mypassword")
+        
+        # Password should be hashed, not stored as plain text
+        assert user.password_hash != "mypassword"
+        assert len(user.password_hash) > 20
     
-    def test_password_verification(self, app):
+    def test_password_verification(self):
         """Test password verification works correctly"""
-        with app.app_context():
-            user = User(username="verifytest", email="verify@example.com")
-            user.set_password("correctpassword")
-            
-            # Correct password should return True
-            assert user.check_password("correctpassword") is True
-            
-            # Incorrect password should return False
-            assert user.check_password("wrongpassword") is False
+        user = User(username="verifytest", email="verify@example.com")
+        user.set_password("correctpassword")
+        
+        # Correct password should return True
+        assert user.check_password("correctpassword") is True
+        
+        # Incorrect password should return False
+        assert user.check_password("wrongpassword") is False
+    
+    def test_password_verification_is_cached(self, monkeypatch):
+        """Test that a recently verified password skips bcrypt"""
+        from models import bcrypt, verified_passwords
+        
+        user = User(username="cachetest", email="cache@example.com")
+        user.set_password("correctpassword")
+        verified_passwords.clear()
+        
+        calls = []
+        check_password_hash = bcrypt.check_password_hash
+        monkeypatch.setattr(
+            bcrypt,
+            "check_password_hash",
+            lambda *args: calls.append(args) or check_password_hash(*args)
+        )
+        
+        assert user.check_password("correctpassword") is True
+        assert user.check_password("correctpassword") is True
+        assert len(calls) == 1
+        
+        # Failed checks are never cached
+        assert user.check_password("wrongpassword") is False
+        assert user.check_password("wrongpassword") is False
+        assert len(calls) == 3
+        
+        # A new password hash invalidates the cached entry
+        user.set_password("correctpassword")
+        assert user.check_password("correctpassword") is True
+        assert len(calls) == 4
     
-    def test_user_to_dict(self, app, sample_user):
+    def test_password_hash_uses_configured_rounds(self, app):
+        """Test that the bcrypt cost comes from the app config"""
+        user = User(username="roundstest", email="rounds@example.com")
+        user.set_password("mypassword")
+        
+        assert user.password_hash[4:6] == "04"
+        assert user.password_needs_rehash() is False
+        
+        # Raising the configured cost flags the old hash as stale
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            assert user.password_needs_rehash() is True
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = 4
+    
+    @pytest.mark.usefixtures('no_lazy_loads')
+    def test_user_to_dict(self, sample_user_nopw):
         """Test user serialization to dictionary"""
-        with app.app_context():
-            user = db.session.merge(sample_user)
-            user_dict = user.to_dict()
-            
-            assert "id" in user_dict
-            assert "username" in user_dict
-            assert "email" in user_dict
-            assert "created_at" in user_dict
-            assert "updated_at" in user_dict
-            # Password should NOT be in the dict
-            assert "password_hash" not in user_dict
+        user = db.session.get(User, sample_user_nopw)
+        user_dict = user.to_dict()
+        
+        assert "id" in user_dict
+        assert "username" in user_dict
+        assert "email" in user_dict
+        assert "created_at" in user_dict
+        assert "updated_at" in user_dict
+        # Password should NOT be in the dict
+        assert "password_hash" not in user_dict
     
-    def test_user_list_relationship(self, app, sample_user):
+    def test_user_list_relationship(self):
         """Test that user-list relationship works"""
-        with app.app_context():
-            user = db.session.merge(sample_user)
-            
-            # Create lists for the user
-            list1 = List(name="List 1", user_id=user.id)
-            list2 = List(name="List 2", user_id=user.id)
-            db.session.add_all([list1, list2])
-            db.session.commit()
-            
-            # Refresh user to get updated relationships
-            db.session.refresh(user)
-            
-            assert len(user.lists) == 2
-            assert list1 in user.lists
-            assert list2 in user.lists
+        # A user of its own, so no other test's lists are counted
+        user = User(username="listowner", email="listowner@example.com")
+        user.password_hash = "dummy_hash_placeholder_12345678"
+        db.session.add(user)
+        db.session.flush()
+        
+        # Create lists for the user
+        list1 = List(name="List 1", user_id=user.id)
+        list2 = List(name="List 2", user_id=user.id)
+        db.session.add_all([list1, list2])
+        db.session.commit()
+        
+        assert len(user.lists) == 2
+        assert list1 in user.lists
+        assert list2 in user.lists
 
 
 class TestListModel:
     """Test cases for List model"""
     
-    def test_list_creation(self, app, sample_user):
+    def test_list_creation(self, sample_user_nopw):
         """Test creating a new list"""
-        with app.app_context():
-            user = db.session.merge(sample_user)
-            list_obj = List(
-                name="My Tasks",
-                description="Daily tasks",
-                user_id=user.id
-            )
-            db.session.add(list_obj)
-            db.session.commit()
-            
-            assert list_obj.id is not None
-            assert list_obj.name == "My Tasks"
-            assert list_obj.description == "Daily tasks"
-            assert list_obj.user_id == user.id
+        user = db.session.get(User, sample_user_nopw)
+        list_obj = List(
+            name="My Tasks",
+            description="Daily tasks",
+            user_id=user.id
+        )
+        db.session.add(list_obj)
+        db.session.commit()
+        
+        assert list_obj.id is not None
+        assert list_obj.name == "My Tasks"
+        assert list_obj.description == "Daily tasks"
+        assert list_obj.user_id == user.id
     
-    def test_list_to_dict(self, app, sample_list):
+    @pytest.mark.usefixtures('no_lazy_loads')
+    def test_list_to_dict(self, sample_list):
         """Test list serialization to dictionary"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            list_dict = list_obj.to_dict()
-            
-            assert "id" in list_dict
-            assert "name" in list_dict
-            assert "description" in list_dict
-            assert "created_at" in list_dict
-            assert "updated_at" in list_dict
-            assert "tasks" in list_dict
-            assert isinstance(list_dict["tasks"], list)
+        # Same eager strategy the routes use for a whole task tree
+        list_obj = db.session.get(List, sample_list, options=[task_tree])
+        list_dict = list_obj.to_dict()
+        
+        assert "id" in list_dict
+        assert "name" in list_dict
+        assert "description" in list_dict
+        assert "created_at" in list_dict
+        assert "updated_at" in list_dict
+        assert "tasks" in list_dict
+        assert isinstance(list_dict["tasks"], list)
     
-    def test_list_tasks_relationship(self, app, sample_list):
+    def test_list_tasks_relationship(self, sample_user_nopw):
         """Test that list-task relationship works"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            
-            # Create tasks for the list
-            task1 = Task(description="Task 1", list_id=list_obj.id)
-            task2 = Task(description="Task 2", list_id=list_obj.id)
-            db.session.add_all([task1, task2])
-            db.session.commit()
-            
-            # Refresh list to get updated relationships
-            db.session.refresh(list_obj)
-            
-            assert len(list_obj.tasks) == 2
+        # A list of its own, so no other test's tasks are counted
+        list_obj = List(name="Relationship List", user_id=sample_user_nopw)
+        db.session.add(list_obj)
+        db.session.flush()
+        
+        # Create tasks for the list
+        task1 = Task(description="Task 1", list_id=list_obj.id)
+        task2 = Task(description="Task 2", list_id=list_obj.id)
+        db.session.add_all([task1, task2])
+        db.session.commit()
+        
+        assert len(list_obj.tasks) == 2
+    
+    def test_timestamps_without_server_defaults(self):
+        """Test that tables created before the timestamps got server
+        defaults (which SQLite cannot add later) still get them on insert"""
+        engine = create_engine('sqlite://')
+        with engine.begin() as connection:
+            connection.exec_driver_sql(
+                'CREATE TABLE lists (id INTEGER PRIMARY KEY, '
+                'name VARCHAR(255) NOT NULL, description TEXT, '
+                'user_id INTEGER NOT NULL, created_at DATETIME, updated_at DATETIME)'
+            )
+            row = connection.execute(
+                insert(List)
+                .values(name='Old List', user_id=1)
+                .returning(List.created_at, List.updated_at)
+            ).one()
+        engine.dispose()
+        
+        assert row.created_at is not None
+        assert row.updated_at is not None
+    
+    def test_list_to_dict_fast_matches_to_dict(self, app, sample_list):
+        """Test the flat-query serializer builds the same nested tree"""
+        list_obj = db.session.get(List, sample_list)
+        
+        parent = Task(description="Parent", list_id=list_obj.id)
+        db.session.add(parent)
+        db.session.flush()
+        child = Task(
+            description="Child",
+            list_id=list_obj.id,
+            parent_id=parent.id
+        )
+        db.session.add(child)
+        db.session.flush()
+        grandchild = Task(
+            description="Grandchild",
+            list_id=list_obj.id,
+            parent_id=child.id
+        )
+        db.session.add(grandchild)
+        db.session.commit()
+        
+        assert app.json.dumps(list_obj.to_dict_fast()) == app.json.dumps(
+            list_obj.to_dict()
+        )
 
 
 class TestTaskModel:
     """Test cases for Task model"""
     
-    def test_task_creation(self, app, sample_list):
+    def test_task_creation(self, sample_list):
         """Test creating a new task"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            task = Task(
-                description="Buy groceries",
-                list_id=list_obj.id,
-                completed=False
-            )
-            db.session.add(task)
-            db.session.commit()
-            
-            assert task.id is not None
-            assert task.description == "Buy groceries"
-            assert task.completed is False
-            assert task.list_id == list_obj.id
-            assert task.parent_id is None
+        list_obj = db.session.get(List, sample_list)
+        task = Task(
+            description="Buy groceries",
+            list_id=list_obj.id,
+            completed=False
+        )
+        db.session.add(task)
+        db.session.commit()
+        
+        assert task.id is not None
+        assert task.description == "Buy groceries"
+        assert task.completed is False
+        assert task.list_id == list_obj.id
+        assert task.parent_id is None
     
-    def test_task_depth_calculation(self, app, sample_list):
+    @pytest.mark.parametrize('name, depth', [
+        ('grandparent', 0),
+        ('parent', 1),
+        ('child1', 2),
+    ])
+    def test_task_depth_calculation(self, task_hierarchy, name, depth):
         """Test that task depth is calculated correctly"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            
-            # Create parent task
-            parent = Task(description="Parent", list_id=list_obj.id)
-            db.session.add(parent)
-            db.session.commit()
-            
-            # Create child task
-            child = Task(
-                description="Child",
-                list_id=list_obj.id,
-                parent_id=parent.id
-            )
-            db.session.add(child)
-            db.session.commit()
-            
-            # Create grandchild task
-            grandchild = Task(
-                description="Grandchild",
-                list_id=list_obj.id,
-                parent_id=child.id
-            )
-            db.session.add(grandchild)
-            db.session.commit()
-            
-            assert parent.get_depth() == 0
-            assert child.get_depth() == 1
-            assert grandchild.get_depth() == 2
+        task = db.session.get(Task, task_hierarchy[name])
+        
+        assert task.get_depth() == depth
     
-    def test_task_can_have_subtasks(self, app, sample_list):
+    def test_task_can_have_subtasks(self, sample_task):
         """Test that infinite nesting is allowed"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            task = Task(description="Test", list_id=list_obj.id)
-            db.session.add(task)
-            db.session.commit()
-            
-            # Should always return True for infinite nesting
-            assert task.can_have_subtasks() is True
-    
-    def test_task_completion_cascade(self, app, sample_list):
-        """Test that completion cascades to all subtasks"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            
-            # Create parent with two children
-            parent = Task(description="Parent", list_id=list_obj.id, completed=False)
-            db.session.add(parent)
-            db.session.commit()
-            
-            child1 = Task(
-                description="Child 1",
-                list_id=list_obj.id,
-                parent_id=parent.id,
-                completed=False
-            )
-            child2 = Task(
-                description="Child 2",
-                list_id=list_obj.id,
-                parent_id=parent.id,
-                completed=False
-            )
-            db.session.add_all([child1, child2])
-            db.session.commit()
-            
-            # Mark parent as complete with cascade
-            parent.set_completion_cascade(True)
-            db.session.commit()
-            
-            # Refresh to get updated values
-            db.session.refresh(parent)
-            db.session.refresh(child1)
-            db.session.refresh(child2)
-            
-            assert parent.completed is True
-            assert child1.completed is True
-            assert child2.completed is True
+        task = db.session.get(Task, sample_task)
+        
+        # Should always return True for infinite nesting
+        assert task.can_have_subtasks() is True
     
-    def test_parent_completion_update_all_children_complete(self, app, sample_list):
-        """Test that parent is marked complete when all children are complete"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            
-            # Create parent with two children
-            parent = Task(description="Parent", list_id=list_obj.id, completed=False)
-            db.session.add(parent)
-            db.session.commit()
-            
-            child1 = Task(
-                description="Child 1",
-                list_id=list_obj.id,
-                parent_id=parent.id,
-                completed=False
-            )
-            child2 = Task(
-                description="Child 2",
-                list_id=list_obj.id,
-                parent_id=parent.id,
-                completed=False
-            )
-            db.session.add_all([child1, child2])
-            db.session.commit()
-            
-            # Mark first child as complete
-            child1.completed = True
-            child1.update_parent_completion()
-            db.session.commit()
-            db.session.refresh(parent)
-            
-            # Parent should still be incomplete (one child incomplete)
-            assert parent.completed is False
-            
-            # Mark second child as complete
-            child2.completed = True
-            child2.update_parent_completion()
-            db.session.commit()
-            db.session.refresh(parent)
-            
-            # Now parent should be complete (all children complete)
-            assert parent.completed is True
+    def test_task_can_move_to_list(self):
+        """Test that only top-level tasks can move to another list"""
+        top_level = Task(description="Top", list_id=1)
+        subtask = Task(description="Subtask", list_id=1, parent_id=1)
+        
+        assert top_level.can_move_to_list(2) is True
+        assert subtask.can_move_to_list(2) is False
+        # Staying in the same list is not a move
+        assert subtask.can_move_to_list(1) is True
     
-    def test_parent_completion_update_child_unchecked(self, app, sample_list):
-        """Test that parent is marked incomplete when a child is unchecked"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            
-            # Create parent with two children, all complete
-            parent = Task(description="Parent", list_id=list_obj.id, completed=True)
-            db.session.add(parent)
-            db.session.commit()
-            
-            child1 = Task(
-                description="Child 1",
-                list_id=list_obj.id,
-                parent_id=parent.id,
-                completed=True
-            )
-            child2 = Task(
-                description="Child 2",
-                list_id=list_obj.id,
-                parent_id=parent.id,
-                completed=True
-            )
-            db.session.add_all([child1, child2])
-            db.session.commit()
-            
-            # Uncheck one child
-            child1.completed = False
-            child1.update_parent_completion()
-            db.session.commit()
-            db.session.refresh(parent)
-            
-            # Parent should now be incomplete
-            assert parent.completed is False
+    @pytest.mark.usefixtures('no_lazy_loads')
+    @pytest.mark.query_budget(1)
+    @pytest.mark.parametrize('name, completed, initial, expected', [
+        # Completing a task completes every task below it, but not above
+        ('parent', True, {}, {
+            'grandparent': False, 'parent': True, 'child1': True, 'child2': True
+        }),
+        ('grandparent', True, {}, {
+            'grandparent': True, 'parent': True, 'child1': True, 'child2': True
+        }),
+        # Unchecking a task unchecks every task below it
+        ('parent', False, {'parent': True, 'child1': True, 'child2': True}, {
+            'grandparent': False, 'parent': False, 'child1': False, 'child2': False
+        }),
+    ])
+    def test_task_completion_cascade(
+        self, task_hierarchy, query_budget, name, completed, initial, expected
+    ):
+        """Test that completion cascades to all subtasks"""
+        tasks = {
+            key: db.session.get(Task, task_id)
+            for key, task_id in task_hierarchy.items()
+        }
+        for key, value in initial.items():
+            tasks[key].completed = value
+        db.session.commit()
+        
+        with query_budget() as queries:
+            tasks[name].set_completion_cascade(completed)
+        db.session.commit()
+        
+        # The whole subtree is updated by one set-based statement;
+        # the query_budget(1) marker holds it to that one statement
+        assert 'WITH RECURSIVE' in queries[0]
+        assert 'UPDATE tasks' in queries[0]
+        
+        assert {key: task.completed for key, task in tasks.items()} == expected
     
-    def test_parent_completion_recursive_update(self, app, sample_list):
-        """Test that completion updates cascade up the hierarchy"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            
-            # Create 3-level hierarchy: grandparent -> parent -> child
-            grandparent = Task(
-                description="Grandparent",
-                list_id=list_obj.id,
-                completed=False
-            )
-            db.session.add(grandparent)
-            db.session.commit()
-            
-            parent = Task(
-                description="Parent",
-                list_id=list_obj.id,
-                parent_id=grandparent.id,
-                completed=False
-            )
-            db.session.add(parent)
-            db.session.commit()
-            
-            child = Task(
-                description="Child",
-                list_id=list_obj.id,
-                parent_id=parent.id,
-                completed=False
-            )
-            db.session.add(child)
-            db.session.commit()
-            
-            # Mark child as complete
-            child.completed = True
-            child.update_parent_completion()
-            db.session.commit()
-            
-            db.session.refresh(parent)
-            db.session.refresh(grandparent)
-            
-            # Both parent and grandparent should be complete
-            assert child.completed is True
-            assert parent.completed is True
-            assert grandparent.completed is True
+    @pytest.mark.usefixtures('no_lazy_loads')
+    # Flushing the child plus one recursive UPDATE for all its ancestors,
+    # however deep the hierarchy
+    @pytest.mark.query_budget(2)
+    @pytest.mark.parametrize('name, completed, initial, expected', [
+        # One incomplete child keeps the parent incomplete
+        ('child1', True, {}, {
+            'grandparent': False, 'parent': False, 'child1': True, 'child2': False
+        }),
+        # Completing the last child completes the parent, and so on upwards
+        ('child2', True, {'child1': True}, {
+            'grandparent': True, 'parent': True, 'child1': True, 'child2': True
+        }),
+        # Unchecking a child marks its ancestors incomplete
+        ('child1', False, {
+            'grandparent': True, 'parent': True, 'child1': True, 'child2': True
+        }, {
+            'grandparent': False, 'parent': False, 'child1': False, 'child2': True
+        }),
+        # Updates stop climbing once a parent's status is unchanged
+        ('child1', True, {'grandparent': True}, {
+            'grandparent': True, 'parent': False, 'child1': True, 'child2': False
+        }),
+    ])
+    def test_parent_completion_update(
+        self, task_hierarchy, query_budget, name, completed, initial, expected
+    ):
+        """Test that a child's completion updates its ancestors"""
+        tasks = {
+            key: db.session.get(Task, task_id)
+            for key, task_id in task_hierarchy.items()
+        }
+        for key, value in initial.items():
+            tasks[key].completed = value
+        db.session.commit()
+        
+        tasks[name].completed = completed
+        with query_budget():
+            tasks[name].update_parent_completion()
+        db.session.commit()
+        
+        assert {key: task.completed for key, task in tasks.items()} == expected
     
-    def test_task_to_dict(self, app, sample_list):
+    @pytest.mark.usefixtures('no_lazy_loads')
+    def test_task_to_dict(self, sample_task):
         """Test task serialization to dictionary"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            task = Task(description="Test Task", list_id=list_obj.id)
-            db.session.add(task)
-            db.session.commit()
-            
-            task_dict = task.to_dict()
-            
-            assert "id" in task_dict
-            assert "description" in task_dict
-            assert "completed" in task_dict
-            assert "created_at" in task_dict
-            assert "updated_at" in task_dict
-            assert "depth" in task_dict
-            assert "can_have_subtasks" in task_dict
-            assert "subtasks" in task_dict
+        task = db.session.get(
+            Task,
+            sample_task,
+            options=[selectinload(Task.subtasks, recursion_depth=-1)]
+        )
+        task_dict = task.to_dict()
+        
+        assert "id" in task_dict
+        assert "description" in task_dict
+        assert "completed" in task_dict
+        assert "created_at" in task_dict
+        assert "updated_at" in task_dict
+        assert "depth" in task_dict
+        assert "can_have_subtasks" in task_dict
+        assert "subtasks" in task_dict
     
-    def test_subtask_relationship(self, app, sample_list):
+    def test_subtask_relationship(self, task_hierarchy):
         """Test parent-child task relationship"""
-        with app.app_context():
-            list_obj = db.session.merge(sample_list)
-            
-            parent = Task(description="Parent Task", list_id=list_obj.id)
-            db.session.add(parent)
-            db.session.commit()
-            
-            child = Task(
-                description="Child Task",
-                list_id=list_obj.id,
-                parent_id=parent.id
-            )
-            db.session.add(child)
-            db.session.commit()
-            
-            db.session.refresh(parent)
-            
-            assert len(parent.subtasks) == 1
-            assert parent.subtasks[0].id == child.id
-            assert child.parent.id == parent.id
+        parent = db.session.get(Task, task_hierarchy['parent'])
+        child = db.session.get(Task, task_hierarchy['child1'])
+        
+        assert len(parent.subtasks) == 2
+        assert child in parent.subtasks
+        assert child.parent.id == parent.id
@@ -3,14 +3,47 @@ Unit tests for List and Task API routes (routes.py)
 Tests CRUD operations, task hierarchy, and completion logic
 """
 
+from datetime import datetime
+from types import SimpleNamespace
+
 import pytest
+from models import List, Task
+from routes import touch_lists
+
+LIST_URL = "/api/lists/{}"
+LIST_TASKS_URL = "/api/lists/{}/tasks"
+TASK_URL = "/api/tasks/{}"
+SUBTASKS_URL = "/api/tasks/{}/subtasks"
+
+# The completion PUTs repeat the same few bodies, so encode them once
+JSON = {"content_type": "application/json"}
+COMPLETE = b'{"completed": true}'
+UNCOMPLETE = b'{"completed": false}'
+CASCADE_COMPLETE = b'{"completed": true, "cascade": true}'
+
+
+@pytest.fixture(scope="module")
+def sample_list(module_session, auth_user):
+    """Create a sample list once per module, with its URLs prebuilt.
+    Each test's tasks roll back with its SAVEPOINT; only the list stays."""
+    list_obj = List(name="Task List", user_id=auth_user)
+    module_session.add(list_obj)
+    touch_lists(auth_user, session=module_session)
+    module_session.commit()
+    list_id = list_obj.id
+    return SimpleNamespace(
+        id=list_id,
+        url=LIST_URL.format(list_id),
+        tasks_url=LIST_TASKS_URL.format(list_id),
+    )
 
 
 class TestListRoutes:
     """Test cases for list API endpoints"""
 
-    def test_create_list(self, client, auth_headers):
-        """Test creating a new list"""
+    def test_list_crud_journey(self, client, auth_headers):
+        """Test creating, listing, updating and deleting a list in turn"""
+        # Create
         response = client.post(
             "/api/lists",
             headers=auth_headers,
@@ -18,93 +51,122 @@ class TestListRoutes:
         )
 
         assert response.status_code == 201
-        assert response.json["name"] == "My Tasks"
-        assert response.json["description"] == "Daily tasks"
-        assert "id" in response.json
+        body = response.get_json()
+        assert body["name"] == "My Tasks"
+        assert body["description"] == "Daily tasks"
+        assert "id" in body
+        list_id = body["id"]
+        list_url = LIST_URL.format(list_id)
+
+        # List
+        response = client.get("/api/lists", headers=auth_headers)
 
-    def test_create_list_without_auth(self, client):
-        """Test creating a list without authentication fails"""
-        response = client.post("/api/lists", json={"name": "My Tasks"})
+        assert response.status_code == 200
+        # The module's sample_list may exist too, so look the list up by id
+        names = {lst["id"]: lst["name"] for lst in response.json}
+        assert names[list_id] == "My Tasks"
 
-        assert response.status_code == 401
+        # Update
+        response = client.put(list_url, headers=auth_headers, json={"name": "Updated"})
 
-    def test_get_all_lists(self, client, auth_headers):
-        """Test getting all lists for a user"""
-        # Create some lists
-        client.post("/api/lists", headers=auth_headers, json={"name": "List 1"})
-        client.post("/api/lists", headers=auth_headers, json={"name": "List 2"})
+        assert response.status_code == 200
+        assert response.json["name"] == "Updated"
 
-        # Get all lists
-        response = client.get("/api/lists", headers=auth_headers)
+        # Delete
+        response = client.delete(list_url, headers=auth_headers)
 
-        assert response.status_code == 200
-        assert len(response.json) == 2
+        assert response.status_code == 204
+        remaining = client.get("/api/lists", headers=auth_headers).json
+        assert list_id not in [lst["id"] for lst in remaining]
 
-    def test_update_list(self, client, auth_headers):
-        """Test updating a list"""
-        # Create a list
-        create_response = client.post(
-            "/api/lists", headers=auth_headers, json={"name": "Original"}
+    def test_timestamps_are_iso_utc(self, client, auth_headers):
+        """Test that datetimes are serialized as ISO 8601 strings in UTC"""
+        response = client.post(
+            "/api/lists", headers=auth_headers, json={"name": "Timestamps"}
         )
-        list_id = create_response.json["id"]
 
-        # Update the list
-        response = client.put(
-            f"/api/lists/{list_id}", headers=auth_headers, json={"name": "Updated"}
+        created_at = datetime.fromisoformat(response.json["created_at"])
+        assert created_at.utcoffset().total_seconds() == 0
+
+    def test_cannot_access_another_users_list(self, client, auth_headers):
+        """Test that lists of other users are not found"""
+        list_id = client.post(
+            "/api/lists", headers=auth_headers, json={"name": "Private"}
+        ).json["id"]
+
+        token = client.post(
+            "/api/auth/register",
+            json={
+                "username": "otheruser",
+                "email": "other@example.com",
+                "password": "password123",
+            },
+        ).json["access_token"]
+        other_headers = {"Authorization": f"Bearer {token}"}
+
+        response = client.get(LIST_URL.format(list_id), headers=other_headers)
+        assert response.status_code == 404
+
+        response = client.post(
+            LIST_TASKS_URL.format(list_id),
+            headers=other_headers,
+            json={"description": "Intruder"},
         )
+        assert response.status_code == 404
 
-        assert response.status_code == 200
-        assert response.json["name"] == "Updated"
+    def test_get_all_lists_etag(self, client, auth_headers):
+        """Test that unchanged lists are answered with 304 and edits change the ETag"""
+        client.post("/api/lists", headers=auth_headers, json={"name": "List 1"})
+
+        response = client.get("/api/lists", headers=auth_headers)
+        etag = response.headers["ETag"]
+        count = len(response.json)
 
-    def test_delete_list(self, client, auth_headers):
-        """Test deleting a list"""
-        # Create a list
-        create_response = client.post(
-            "/api/lists", headers=auth_headers, json={"name": "To Delete"}
+        response = client.get(
+            "/api/lists", headers={**auth_headers, "If-None-Match": etag}
         )
-        list_id = create_response.json["id"]
+        assert response.status_code == 304
 
-        # Delete the list
-        response = client.delete(f"/api/lists/{list_id}", headers=auth_headers)
+        client.post("/api/lists", headers=auth_headers, json={"name": "List 2"})
 
-        assert response.status_code == 204
+        response = client.get(
+            "/api/lists", headers={**auth_headers, "If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+        assert len(response.json) == count + 1
+
+    def test_create_list_without_auth(self, client):
+        """Test creating a list without authentication fails"""
+        response = client.post("/api/lists", json={"name": "My Tasks"})
+
+        assert response.status_code == 401
 
 
 class TestTaskRoutes:
     """Test cases for task API endpoints"""
 
-    @pytest.fixture
-    def sample_list(self, client, auth_headers):
-        """Create a sample list for task testing"""
-        response = client.post(
-            "/api/lists", headers=auth_headers, json={"name": "Task List"}
-        )
-        return response.json
-
     def test_create_task(self, client, auth_headers, sample_list):
         """Test creating a new task"""
         response = client.post(
-            f'/api/lists/{sample_list["id"]}/tasks',
+            sample_list.tasks_url,
             headers=auth_headers,
             json={"description": "Buy groceries"},
         )
 
         assert response.status_code == 201
-        assert response.json["description"] == "Buy groceries"
-        assert response.json["completed"] is False
+        body = response.get_json()
+        assert body["description"] == "Buy groceries"
+        assert body["completed"] is False
 
-    def test_create_subtask(self, client, auth_headers, sample_list):
+    def test_create_subtask(self, client, auth_headers, sample_list, seed):
         """Test creating a subtask"""
         # Create parent task
-        parent = client.post(
-            f'/api/lists/{sample_list["id"]}/tasks',
-            headers=auth_headers,
-            json={"description": "Parent"},
-        ).json
+        parent_id = seed.make_task(sample_list.id, "Parent")
 
         # Create subtask
         response = client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
+            SUBTASKS_URL.format(parent_id),
             headers=auth_headers,
             json={"description": "Subtask"},
         )
@@ -112,216 +174,278 @@ class TestTaskRoutes:
         assert response.status_code == 201
         assert response.json["depth"] == 1
 
-    def test_toggle_task_completion(self, client, auth_headers, sample_list):
-        """Test marking a task as complete"""
-        # Create task
-        task = client.post(
-            f'/api/lists/{sample_list["id"]}/tasks',
-            headers=auth_headers,
-            json={"description": "Task"},
-        ).json
-
-        # Mark as complete
-        response = client.put(
-            f'/api/tasks/{task["id"]}', headers=auth_headers, json={"completed": True}
-        )
-
-        assert response.status_code == 200
-        assert response.json["completed"] is True
-
-    def test_cascade_completion_to_subtasks(self, client, auth_headers, sample_list):
-        """Test marking parent complete cascades to all subtasks"""
-        # Create parent with subtasks
-        parent = client.post(
-            f'/api/lists/{sample_list["id"]}/tasks',
-            headers=auth_headers,
-            json={"description": "Parent"},
-        ).json
-
-        client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
-            headers=auth_headers,
-            json={"description": "Sub 1"},
-        )
-        client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
+    def test_bulk_create_nested_tasks(self, client, auth_headers, sample_list):
+        """Test creating a nested task tree in one request"""
+        response = client.post(
+            f"{sample_list.tasks_url}/bulk",
             headers=auth_headers,
-            json={"description": "Sub 2"},
+            json=[
+                {
+                    "description": "Parent",
+                    "subtasks": [
+                        {"description": "Sub 1", "completed": True},
+                        {
+                            "description": "Sub 2",
+                            "subtasks": [{"description": "Sub-sub"}],
+                        },
+                    ],
+                },
+                {"description": "Second"},
+            ],
         )
 
-        # Mark parent as complete with cascade
-        client.put(
-            f'/api/tasks/{parent["id"]}',
+        assert response.status_code == 201
+        tasks = response.json["tasks"]
+        assert [task["description"] for task in tasks] == ["Parent", "Second"]
+        subtasks = tasks[0]["subtasks"]
+        assert [sub["description"] for sub in subtasks] == ["Sub 1", "Sub 2"]
+        assert subtasks[0]["completed"] is True
+        assert subtasks[1]["subtasks"][0]["depth"] == 2
+
+    @pytest.mark.parametrize(
+        "subtasks",
+        [
+            [{"completed": True}],
+            # subtasks must be a list when present
+            None,
+            {"description": "Sub"},
+            [{"description": "Sub", "completed": "maybe"}],
+        ],
+        ids=[
+            "missing_description",
+            "null_subtasks",
+            "subtasks_not_a_list",
+            "completed_not_a_boolean",
+        ],
+    )
+    def test_bulk_create_requires_descriptions(
+        self, client, auth_headers, sample_list, subtasks
+    ):
+        """Test that an invalid tree is rejected without inserting anything"""
+        response = client.post(
+            f"{sample_list.tasks_url}/bulk",
             headers=auth_headers,
-            json={"completed": True, "cascade": True},
+            json=[{"description": "Parent", "subtasks": subtasks}],
         )
 
-        # Get parent and verify all subtasks are complete
-        result = client.get(f'/api/tasks/{parent["id"]}', headers=auth_headers).json
-
-        assert result["completed"] is True
-        assert all(sub["completed"] for sub in result["subtasks"])
+        assert response.status_code == 400
+        result = client.get(sample_list.url, headers=auth_headers)
+        assert result.json["tasks"] == []
 
-    def test_parent_autocomplete_when_all_children_complete(
-        self, client, auth_headers, sample_list
+    @pytest.mark.parametrize("subtask", [False, True], ids=["task", "subtask"])
+    def test_create_task_rejects_non_boolean_completed(
+        self, client, auth_headers, sample_list, seed, subtask
     ):
-        """Test parent auto-completes when ALL children are complete"""
-        # Create parent with two subtasks
-        parent = client.post(
-            f'/api/lists/{sample_list["id"]}/tasks',
-            headers=auth_headers,
-            json={"description": "Parent"},
-        ).json
-
-        sub1 = client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
-            headers=auth_headers,
-            json={"description": "Sub 1"},
-        ).json
+        """Test that creating a task with a completed value other than
+        true/false is rejected"""
+        if subtask:
+            url = SUBTASKS_URL.format(seed.make_task(sample_list.id, "Parent"))
+        else:
+            url = sample_list.tasks_url
 
-        sub2 = client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
+        response = client.post(
+            url,
             headers=auth_headers,
-            json={"description": "Sub 2"},
-        ).json
-
-        # Complete first subtask - parent should still be incomplete
-        client.put(
-            f'/api/tasks/{sub1["id"]}', headers=auth_headers, json={"completed": True}
+            json={"description": "Task", "completed": "maybe"},
         )
 
-        parent_status = client.get(
-            f'/api/tasks/{parent["id"]}', headers=auth_headers
-        ).json
-        assert parent_status["completed"] is False
+        assert response.status_code == 400
+        assert response.json["error"] == "Completed must be true or false"
 
-        # Complete second subtask - parent should auto-complete
-        client.put(
-            f'/api/tasks/{sub2["id"]}', headers=auth_headers, json={"completed": True}
+    def test_toggle_task_completion(self, client, auth_headers, sample_list, seed):
+        """Test marking a task as complete"""
+        # Create task
+        task_id = seed.make_task(sample_list.id, "Task")
+
+        # Mark as complete
+        response = client.put(
+            TASK_URL.format(task_id), headers=auth_headers, data=COMPLETE, **JSON
         )
 
-        parent_status = client.get(
-            f'/api/tasks/{parent["id"]}', headers=auth_headers
-        ).json
-        assert parent_status["completed"] is True
+        assert response.status_code == 200
+        assert response.json["completed"] is True
 
-    def test_parent_auto_uncomplete_when_child_unchecked(
-        self, client, auth_headers, sample_list
+    @pytest.fixture
+    def parent_with_subtasks(self, seed, sample_list):
+        """Create a parent task with two subtasks and return their ids"""
+        parent_id = seed.make_task(sample_list.id, "Parent")
+        subtask_ids = seed.make_tasks(
+            sample_list.id, ["Sub 1", "Sub 2"], parent_id=parent_id
+        )
+        return parent_id, subtask_ids
+
+    @pytest.mark.parametrize(
+        "updates, parent_completed, subtasks_completed",
+        [
+            # Marking the parent complete with cascade completes all subtasks
+            ([("parent", CASCADE_COMPLETE)], True, [True, True]),
+            # Parent stays incomplete while any subtask is incomplete
+            ([(0, COMPLETE)], False, [True, False]),
+            # Parent auto-completes when ALL subtasks are complete
+            ([(0, COMPLETE), (1, COMPLETE)], True, [True, True]),
+            # Parent auto-uncompletes when ANY subtask is unchecked
+            ([(0, COMPLETE), (1, COMPLETE), (0, UNCOMPLETE)], False, [False, True]),
+        ],
+        ids=["cascade_down", "stays_open", "autocomplete_up", "auto_uncomplete"],
+    )
+    def test_completion_propagation(
+        self,
+        client,
+        auth_headers,
+        db_session,
+        parent_with_subtasks,
+        updates,
+        parent_completed,
+        subtasks_completed,
     ):
-        """Test parent auto-uncompletes when a child is unchecked"""
-        # Create parent with subtasks and complete them
-        parent = client.post(
-            f'/api/lists/{sample_list["id"]}/tasks',
-            headers=auth_headers,
-            json={"description": "Parent"},
-        ).json
-
-        sub1 = client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
+        """Test completion cascading down to subtasks and up to the parent"""
+        parent_id, subtask_ids = parent_with_subtasks
+
+        for target, payload in updates:
+            task_id = parent_id if target == "parent" else subtask_ids[target]
+            response = client.put(
+                TASK_URL.format(task_id), headers=auth_headers, data=payload, **JSON
+            )
+            assert response.status_code == 200
+
+        # The PUTs are under test, so read the outcome straight from the session
+        subtasks = [db_session.get(Task, task_id) for task_id in subtask_ids]
+        assert db_session.get(Task, parent_id).completed is parent_completed
+        assert [sub.completed for sub in subtasks] == subtasks_completed
+
+    @pytest.mark.parametrize("cascade", [False, True], ids=["single", "cascade"])
+    def test_update_rejects_non_boolean_completed(
+        self, client, auth_headers, db_session, parent_with_subtasks, cascade
+    ):
+        """Test that a completed value other than true/false is rejected
+        without touching the task or its subtasks"""
+        parent_id, subtask_ids = parent_with_subtasks
+        response = client.put(
+            TASK_URL.format(parent_id),
             headers=auth_headers,
-            json={"description": "Sub 1"},
-        ).json
+            json={"completed": "false", "cascade": cascade},
+        )
 
-        sub2 = client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
-            headers=auth_headers,
-            json={"description": "Sub 2"},
-        ).json
+        assert response.status_code == 400
+        tasks = [db_session.get(Task, task_id) for task_id in [parent_id, *subtask_ids]]
+        assert [task.completed for task in tasks] == [False, False, False]
 
-        # Complete both (parent will auto-complete)
-        client.put(
-            f'/api/tasks/{sub1["id"]}', headers=auth_headers, json={"completed": True}
-        )
-        client.put(
-            f'/api/tasks/{sub2["id"]}', headers=auth_headers, json={"completed": True}
+    def test_update_includes_parent(self, client, auth_headers, parent_with_subtasks):
+        """Test the PUT response carries the auto-completed parent on request"""
+        parent_id, subtask_ids = parent_with_subtasks
+        response = client.put(
+            TASK_URL.format(subtask_ids[0]), headers=auth_headers, data=COMPLETE, **JSON
         )
+        assert response.status_code == 200
 
-        # Uncheck one subtask - parent should auto-uncomplete
-        client.put(
-            f'/api/tasks/{sub1["id"]}', headers=auth_headers, json={"completed": False}
+        response = client.put(
+            TASK_URL.format(subtask_ids[1]),
+            query_string={"include": "parent"},
+            headers=auth_headers,
+            data=COMPLETE,
+            **JSON,
         )
 
-        parent_status = client.get(
-            f'/api/tasks/{parent["id"]}', headers=auth_headers
-        ).json
-        assert parent_status["completed"] is False
+        assert response.status_code == 200
+        parent = response.json["parent"]
+        assert parent["id"] == parent_id
+        assert parent["completed"] is True
+        assert "subtasks" not in parent
 
-    def test_move_task_to_different_list(self, client, auth_headers):
+    def test_move_task_to_different_list(self, client, auth_headers, db_session, seed):
         """Test moving a top-level task to a different list"""
         # Create two lists
-        list1 = client.post(
-            "/api/lists", headers=auth_headers, json={"name": "List 1"}
-        ).json
-
-        list2 = client.post(
-            "/api/lists", headers=auth_headers, json={"name": "List 2"}
-        ).json
+        list1_id = seed.make_list("List 1")
+        list2_id = seed.make_list("List 2")
 
         # Create task in list1
-        task = client.post(
-            f'/api/lists/{list1["id"]}/tasks',
-            headers=auth_headers,
-            json={"description": "Task"},
-        ).json
+        task_id = seed.make_task(list1_id, "Task")
 
         # Move to list2
         response = client.put(
-            f'/api/tasks/{task["id"]}',
+            TASK_URL.format(task_id),
             headers=auth_headers,
-            json={"list_id": list2["id"]},
+            json={"list_id": list2_id},
         )
 
         assert response.status_code == 200
+        assert db_session.get(Task, task_id).list_id == list2_id
 
     def test_cannot_move_subtask_to_different_list(
-        self, client, auth_headers, sample_list
+        self, client, auth_headers, db_session, sample_list, seed
     ):
         """Test that subtasks cannot be moved between lists"""
         # Create parent and subtask
-        parent = client.post(
-            f'/api/lists/{sample_list["id"]}/tasks',
-            headers=auth_headers,
-            json={"description": "Parent"},
-        ).json
-
-        subtask = client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
-            headers=auth_headers,
-            json={"description": "Subtask"},
-        ).json
+        parent_id = seed.make_task(sample_list.id, "Parent")
+        subtask_id = seed.make_task(sample_list.id, "Subtask", parent_id=parent_id)
 
         # Create another list
-        list2 = client.post(
-            "/api/lists", headers=auth_headers, json={"name": "List 2"}
-        ).json
+        list2_id = seed.make_list("List 2")
 
         # Try to move subtask
         response = client.put(
-            f'/api/tasks/{subtask["id"]}',
+            TASK_URL.format(subtask_id),
             headers=auth_headers,
-            json={"list_id": list2["id"]},
+            json={"list_id": list2_id},
         )
 
         assert response.status_code == 400
+        assert db_session.get(Task, subtask_id).list_id == sample_list.id
 
-    def test_delete_task_cascades_to_subtasks(self, client, auth_headers, sample_list):
+    def test_move_task_moves_its_subtasks(self, client, auth_headers, seed):
+        """Test that a moved task takes its whole subtree to the new list"""
+        list1_id = seed.make_list("List 1")
+        list2_id = seed.make_list("List 2")
+        parent_id = seed.make_task(list1_id, "Parent")
+        subtask_id = seed.make_task(list1_id, "Subtask", parent_id=parent_id)
+        seed.make_task(list1_id, "Sub-subtask", parent_id=subtask_id)
+
+        response = client.put(
+            TASK_URL.format(parent_id), headers=auth_headers, json={"list_id": list2_id}
+        )
+        assert response.status_code == 200
+
+        old_list = client.get(LIST_URL.format(list1_id), headers=auth_headers)
+        assert old_list.status_code == 200
+        assert old_list.json["tasks"] == []
+
+        new_list = client.get(LIST_URL.format(list2_id), headers=auth_headers)
+        assert new_list.status_code == 200
+        (parent,) = new_list.json["tasks"]
+        assert parent["id"] == parent_id
+        (subtask,) = parent["subtasks"]
+        assert subtask["id"] == subtask_id
+        assert [sub["description"] for sub in subtask["subtasks"]] == ["Sub-subtask"]
+
+    def test_get_list_skips_subtasks_left_in_another_list(
+        self, client, auth_headers, seed
+    ):
+        """Test that a subtask stranded in another list by an older release
+        does not break reading either list"""
+        list1_id = seed.make_list("List 1")
+        list2_id = seed.make_list("List 2")
+        parent_id = seed.make_task(list2_id, "Parent")
+        seed.make_task(list1_id, "Stranded", parent_id=parent_id)
+
+        old_list = client.get(LIST_URL.format(list1_id), headers=auth_headers)
+        assert old_list.status_code == 200
+        assert old_list.json["tasks"] == []
+
+        new_list = client.get(LIST_URL.format(list2_id), headers=auth_headers)
+        assert new_list.status_code == 200
+        assert [task["id"] for task in new_list.json["tasks"]] == [parent_id]
+
+    def test_delete_task_cascades_to_subtasks(
+        self, client, auth_headers, sample_list, seed
+    ):
         """Test that deleting a task deletes all its subtasks"""
         # Create parent with subtask
-        parent = client.post(
-            f'/api/lists/{sample_list["id"]}/tasks',
-            headers=auth_headers,
-            json={"description": "Parent"},
-        ).json
-
-        subtask = client.post(
-            f'/api/tasks/{parent["id"]}/subtasks',
-            headers=auth_headers,
-            json={"description": "Subtask"},
-        ).json
+        parent_id = seed.make_task(sample_list.id, "Parent")
+        subtask_id = seed.make_task(sample_list.id, "Subtask", parent_id=parent_id)
 
         # Delete parent
-        client.delete(f'/api/tasks/{parent["id"]}', headers=auth_headers)
+        client.delete(TASK_URL.format(parent_id), headers=auth_headers)
 
         # Verify subtask is also deleted
-        response = client.get(f'/api/tasks/{subtask["id"]}', headers=auth_headers)
+        response = client.get(TASK_URL.format(subtask_id), headers=auth_headers)
         assert response.status_code == 404